@@ -1,11 +1,15 @@
+import asyncio
 import logging
 import os
-from flask import Flask, jsonify
-from flask_cors import CORS
+from concurrent.futures import ThreadPoolExecutor
+from quart import Quart, jsonify
+from quart_cors import cors
+from pymongo.errors import PyMongoError
 from config import config
-from routes.extract_routes import extract_bp, set_invoice_model
+from routes.extract_routes import extract_bp, set_invoice_model, close_services, drain_pending_saves, change_feed
 from models.invoices import InvoiceModel
 from routes.auth_routes import auth_bp
+from utils.json_provider import ORJSONProvider
 
 # Configure logging
 logging.basicConfig(
@@ -14,35 +18,57 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def create_app(config_name: str = 'development') -> Flask:
+def create_app(config_name: str = 'development') -> Quart:
     """Application factory"""
-    app = Flask(__name__)
+    app = Quart(__name__)
     app.config.from_object(config[config_name])
+    app.json = ORJSONProvider(app)
 
     # ------------------------------------------------------------
     # 👇 FIXED CORS SECTION
     # This explicitly allows PUT requests and Authorization headers
     # ------------------------------------------------------------
-    CORS(app, resources={r"/*": {
-    "origins": [
-        "https://shard-9qyi.onrender.com", 
-        "http://localhost:8080"
-    ],
-    "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    "allow_headers": ["Content-Type", "Authorization"]
-}})
+    app = cors(
+        app,
+        allow_origin=[
+            "https://shard-9qyi.onrender.com",
+            "http://localhost:8080"
+        ],
+        allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+        allow_headers=["Content-Type", "Authorization"]
+    )
     # ------------------------------------------------------------
 
-    # Initialize MongoDB
-    try:
-        invoice_model = InvoiceModel(
-            mongodb_uri=app.config['MONGODB_URI'],
-            db_name=app.config['MONGODB_DB_NAME']
+    # Initialize MongoDB per worker, after any fork: Motor clients must not be
+    # shared across processes, so nothing is opened at import time
+    @app.before_serving
+    async def init_executor():
+        # Explicitly size the pool behind asyncio.to_thread rather than relying on the default
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=app.config['THREAD_POOL_SIZE'], thread_name_prefix="shard-worker")
         )
-        set_invoice_model(invoice_model)
-        logger.info("MongoDB initialized successfully")
-    except Exception as e:
-        logger.warning(f"MongoDB initialization failed: {str(e)} - Running without database")
+
+    @app.before_serving
+    async def init_database():
+        try:
+            invoice_model = InvoiceModel(
+                mongodb_uri=app.config['MONGODB_URI'],
+                db_name=app.config['MONGODB_DB_NAME']
+            )
+            await invoice_model.create_indexes()
+            set_invoice_model(invoice_model)
+            change_feed.start(invoice_model.db.invoices)
+            logger.info("MongoDB initialized successfully")
+        except PyMongoError as e:
+            logger.warning("MongoDB initialization failed: %s - Running without database", e)
+            # No change stream will run: websocket clients are closed so they poll instead
+            change_feed.close_subscribers()
+
+    @app.after_serving
+    async def close_clients():
+        await change_feed.stop()
+        await drain_pending_saves()
+        await close_services()
 
     # Register blueprints
     app.register_blueprint(extract_bp)
@@ -50,21 +76,21 @@ def create_app(config_name: str = 'development') -> Flask:
 
     # Error handlers
     @app.errorhandler(404)
-    def not_found(error):
+    async def not_found(error):
         return jsonify({"error": "Endpoint not found"}), 404
 
     @app.errorhandler(500)
-    def internal_error(error):
-        logger.error(f"Internal error: {str(error)}")
+    async def internal_error(error):
+        logger.error("Internal error: %s", error)
         return jsonify({"error": "Internal server error"}), 500
 
     @app.errorhandler(405)
-    def method_not_allowed(error):
+    async def method_not_allowed(error):
         return jsonify({"error": "Method not allowed"}), 405
 
     # Root endpoint
     @app.route('/', methods=['GET'])
-    def index():
+    async def index():
         return jsonify({
             "service": "Invoice Extraction API",
             "version": "1.0.0",
@@ -74,17 +100,18 @@ def create_app(config_name: str = 'development') -> Flask:
                 "extract": "POST /api/extract",
                 "review_queue": "GET /api/review-queue",
                 "approve": "PUT /api/invoices/<invoice_id>/status",
-                "analytics": "GET /api/analytics"
+                "analytics": "GET /api/analytics",
+                "review_queue_updates": "WS /api/ws/review-queue?token=<token>"
             }
         }), 200
 
-    logger.info(f"App created with config: {config_name}")
+    logger.info("App created with config: %s", config_name)
     return app
 env_name = os.getenv('FLASK_ENV', 'production')
 app = create_app(env_name)
 
 if __name__ == '__main__':
-    # When running locally
+    # When running locally (production: uvicorn app:app --workers N --loop uvloop)
     app.run(
         host='0.0.0.0',
         port=int(os.getenv('API_PORT', 5000)),
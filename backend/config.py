@@ -6,10 +6,24 @@ class Config:
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev-key-change-in-production')
     GROQ_API_KEY = os.getenv('GROQ_API_KEY')
     GROQ_MODEL = os.getenv('GROQ_MODEL', 'meta-llama/llama-4-scout-17b-16e-instruct')
+    GROQ_BASE_URL = os.getenv('GROQ_BASE_URL', 'https://api.groq.com')
+    GROQ_TIMEOUT = float(os.getenv('GROQ_TIMEOUT', 60))
+    GROQ_MAX_RETRIES = int(os.getenv('GROQ_MAX_RETRIES', 2))
+    GROQ_MAX_CONNECTIONS = int(os.getenv('GROQ_MAX_CONNECTIONS', 200))
+    GROQ_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('GROQ_MAX_KEEPALIVE_CONNECTIONS', 100))
+    # Threads for asyncio.to_thread work (image quality checks); defaults to min(32, cpu + 4)
+    THREAD_POOL_SIZE = int(os.getenv('THREAD_POOL_SIZE', min(32, (os.cpu_count() or 1) + 4)))
     MONGODB_URI = os.getenv('MONGODB_URI')
     MONGODB_DB_NAME = os.getenv('MONGODB_DB_NAME', 'invoice_db')
     UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'static/uploads')
     MAX_FILE_SIZE = int(os.getenv('MAX_FILE_SIZE', 10485760))
+    # Admission control for /extract: concurrent extractions per worker, and how long to wait for a slot
+    EXTRACT_CONCURRENCY = int(os.getenv('EXTRACT_CONCURRENCY', 32))
+    EXTRACT_QUEUE_TIMEOUT = float(os.getenv('EXTRACT_QUEUE_TIMEOUT', 0.25))
+    QUERY_CACHE_TTL = float(os.getenv('QUERY_CACHE_TTL', 5))
+    QUERY_CACHE_MAXSIZE = int(os.getenv('QUERY_CACHE_MAXSIZE', 1024))
+    EXTRACTION_CACHE_TTL = float(os.getenv('EXTRACTION_CACHE_TTL', 86400))
+    EXTRACTION_CACHE_MAXSIZE = int(os.getenv('EXTRACTION_CACHE_MAXSIZE', 1024))
     JSON_SORT_KEYS = False
 class DevelopmentConfig(Config):
     """Development configuration"""
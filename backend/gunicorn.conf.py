@@ -0,0 +1,18 @@
+import multiprocessing
+import os
+
+# Gunicorn settings for production: gunicorn app:app -c gunicorn.conf.py
+# Each Uvicorn worker runs one event loop that multiplexes many in-flight
+# Groq/MongoDB calls, so one worker per core is enough for this I/O-bound API.
+bind = f"0.0.0.0:{os.getenv('PORT', os.getenv('API_PORT', 5000))}"
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+
+# Import the app once in the master and fork: workers share loaded modules
+# (OpenCV, numpy) copy-on-write. DB/HTTP clients are opened per worker at startup.
+preload_app = True
+
+# Groq extractions can take up to GROQ_TIMEOUT seconds
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
@@ -1,7 +1,9 @@
 from datetime import datetime
 from typing import Optional, List, Dict, Any
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import PyMongoError
 from bson import ObjectId
+from bson.errors import InvalidId
 import os
 import logging
 
@@ -10,36 +12,40 @@ logger = logging.getLogger(__name__)
 class InvoiceModel:
     """MongoDB invoice model and CRUD operations"""
 
+    # Compound index backing the activity feed's filter + sort
+    FEED_INDEX = [("userId", 1), ("created_at", -1)]
+    # Fields the activity feed never renders (it reads extracted_data, not canonical_data)
+    FEED_PROJECTION = {"canonical_data": 0, "api_metadata": 0, "corrections": 0, "file_hash": 0}
+
     def __init__(self, mongodb_uri: str, db_name: str):
         """Initialize MongoDB connection"""
         try:
-            self.client = MongoClient(mongodb_uri)
+            self.client = AsyncIOMotorClient(mongodb_uri)
             self.db = self.client[db_name]
-
-            # Create indexes for performance
-            self._create_indexes()
-            logger.info("MongoDB connection established")
-        except Exception as e:
-            logger.error(f"MongoDB connection failed: {str(e)}")
+            logger.info("MongoDB client created")
+        except PyMongoError as e:
+            logger.error("MongoDB connection failed: %s", e)
             raise
 
-    def _create_indexes(self):
-        """Create MongoDB indexes for performance"""
+    async def create_indexes(self):
+        """Create MongoDB indexes for performance (called once at startup)"""
         # Invoices collection
-        self.db.invoices.create_index([("created_at", -1)])
-        self.db.invoices.create_index([("status", 1)])
-        self.db.invoices.create_index([("extracted_data.invoice_metadata.date", 1)])
-        self.db.invoices.create_index([("canonical_data.vendor_name_canonical.canonical_id", 1)])
+        await self.db.invoices.create_index([("created_at", -1)])
+        await self.db.invoices.create_index(self.FEED_INDEX)
+        await self.db.invoices.create_index([("file_hash", 1)])
+        await self.db.invoices.create_index([("status", 1)])
+        await self.db.invoices.create_index([("extracted_data.invoice_metadata.date", 1)])
+        await self.db.invoices.create_index([("canonical_data.vendor_name_canonical.canonical_id", 1)])
 
         # Vendor master collection
-        self.db.vendor_master.create_index([("canonical_id", 1)], unique=True)
-        self.db.vendor_master.create_index([("vendor_name_variations", 1)])
+        await self.db.vendor_master.create_index([("canonical_id", 1)], unique=True)
+        await self.db.vendor_master.create_index([("vendor_name_variations", 1)])
 
         # Audit log collection
-        self.db.audit_log.create_index([("invoice_id", 1)])
-        self.db.audit_log.create_index([("timestamp", -1)])
+        await self.db.audit_log.create_index([("invoice_id", 1)])
+        await self.db.audit_log.create_index([("timestamp", -1)])
 
-    def save_extraction(
+    async def save_extraction(
         self,
         user_id: str,                          # 👈 FIXED NAME
         extracted_data: Dict[str, Any],
@@ -47,35 +53,45 @@ class InvoiceModel:
         confidence_scores: Dict[str, Any],
         status: str,
         original_filename: str = None,
-        metadata: Dict[str, Any] = None
+        metadata: Dict[str, Any] = None,
+        invoice_id: Optional[ObjectId] = None,
+        file_hash: Optional[str] = None
     ) -> str:
         """
         Save extraction result to MongoDB
+        invoice_id: optional pre-generated _id, so callers can respond before the write lands
+        file_hash: content hash of the upload, used to reuse extractions of duplicate files
         Returns: invoice_id (ObjectId as string)
         """
         try:
+            now = datetime.utcnow()
             invoice_doc = {
                 "userId": user_id,                # 👈 NOW IT MATCHES THE ARG
                 "extracted_data": extracted_data,
                 "canonical_data": canonical_data,
                 "confidence_scores": confidence_scores,
-                "updated_at": datetime.utcnow(),
+                "created_at": now,
+                "updated_at": now,
                 "approved_by": None,
                 "approved_at": None,
                 "notes": "",
                 "corrections": {},
-                "api_metadata": metadata or {}
+                "api_metadata": metadata or {},
+                "file_hash": file_hash
             }
 
-            result = self.db.invoices.insert_one(invoice_doc)
+            if invoice_id is not None:
+                invoice_doc["_id"] = invoice_id
+
+            result = await self.db.invoices.insert_one(invoice_doc)
             invoice_id = str(result.inserted_id)
 
             # Audit log
-            self.db.audit_log.insert_one({
+            await self.db.audit_log.insert_one({
                 "invoice_id": ObjectId(invoice_id),
                 "userId": user_id,                # 👈 ADD USER IN AUDIT LOG
                 "action": "extracted",
-                "timestamp": datetime.utcnow(),
+                "timestamp": now,
                 "changes": {
                     "status": status,
                     "confidence": confidence_scores.get('overall_confidence'),
@@ -83,36 +99,42 @@ class InvoiceModel:
                 }
             })
 
-            logger.info(f"Invoice saved for user {user_id}: {invoice_id}")
+            logger.info("Invoice saved for user %s: %s", user_id, invoice_id)
             return invoice_id
 
-        except Exception as e:
-            logger.error(f"Failed to save extraction: {str(e)}")
+        except PyMongoError as e:
+            logger.error("Failed to save extraction: %s", e)
             raise
 
-    def get_invoice(self, invoice_id: str) -> Optional[Dict[str, Any]]:
+    async def find_extraction_by_hash(self, file_hash: str) -> Optional[Dict[str, Any]]:
+        """Return the extracted_data of an earlier upload with the same content hash"""
+        invoice = await self.db.invoices.find_one({"file_hash": file_hash}, {"extracted_data": 1})
+        return invoice.get("extracted_data") if invoice else None
+
+    async def get_invoice(self, invoice_id: str) -> Optional[Dict[str, Any]]:
         """Fetch single invoice by ID"""
         try:
-            invoice = self.db.invoices.find_one({"_id": ObjectId(invoice_id)})
+            invoice = await self.db.invoices.find_one({"_id": ObjectId(invoice_id)})
             if invoice:
                 invoice["_id"] = str(invoice["_id"])
                 return invoice
-        except Exception as e:
-            logger.error(f"Failed to get invoice: {str(e)}")
+        except (PyMongoError, InvalidId) as e:
+            logger.error("Failed to get invoice: %s", e)
             return None
 
-    def get_all_invoices(self, status: Optional[str] = None, limit: int = 10, skip: int = 0) -> List[Dict[str, Any]]:
+    async def get_all_invoices(self, status: Optional[str] = None, limit: int = 10, skip: int = 0) -> List[Dict[str, Any]]:
         """Fetch invoices with optional filtering"""
         try:
             query = {}
             if status:
                 query["status"] = status
 
-            invoices = list(
+            invoices = await (
                 self.db.invoices.find(query)
                 .sort("created_at", -1)
                 .skip(skip)
                 .limit(limit)
+                .to_list(length=limit)
             )
 
             # Convert ObjectId to string
@@ -120,82 +142,95 @@ class InvoiceModel:
                 inv["_id"] = str(inv["_id"])
 
             return invoices
-        except Exception as e:
-            logger.error(f"Failed to get invoices: {str(e)}")
+        except PyMongoError as e:
+            logger.error("Failed to get invoices: %s", e)
             return []
 
-    def get_review_queue(self, limit: int = 20) -> List[Dict[str, Any]]:
+    async def get_user_invoices(self, user_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """Fetch a user's most recent invoices for the activity feed (index-backed sort)"""
+        cursor = (
+            self.db.invoices.find({"userId": user_id}, self.FEED_PROJECTION)
+            .sort("created_at", -1)
+            .hint(self.FEED_INDEX)
+            .limit(limit)
+        )
+        # ObjectIds are serialized by the JSON provider, no per-document conversion needed
+        return await cursor.to_list(length=limit)
+
+    async def get_review_queue(self, limit: int = 20) -> List[Dict[str, Any]]:
         """Get invoices needing human review"""
-        return self.get_all_invoices(status="needs_review", limit=limit)
+        return await self.get_all_invoices(status="needs_review", limit=limit)
 
-    def update_status(self, invoice_id: str, new_status: str, notes: str = "", approved_by: str = None) -> bool:
+    async def update_status(self, invoice_id: str, new_status: str, notes: str = "", approved_by: str = None) -> bool:
         """Update invoice approval status"""
         try:
-            result = self.db.invoices.update_one(
+            now = datetime.utcnow()
+            result = await self.db.invoices.update_one(
                 {"_id": ObjectId(invoice_id)},
                 {
                     "$set": {
                         "status": new_status,
-                        "updated_at": datetime.utcnow(),
+                        "updated_at": now,
                         "notes": notes,
                         "approved_by": approved_by,
-                        "approved_at": datetime.utcnow() if new_status == "approved" else None
+                        "approved_at": now if new_status == "approved" else None
                     }
                 }
             )
 
             # Log to audit trail
-            self.db.audit_log.insert_one({
+            await self.db.audit_log.insert_one({
                 "invoice_id": ObjectId(invoice_id),
                 "action": "status_updated",
                 "new_status": new_status,
-                "timestamp": datetime.utcnow(),
+                "timestamp": now,
                 "approved_by": approved_by
             })
 
             return result.modified_count > 0
 
-        except Exception as e:
-            logger.error(f"Failed to update status: {str(e)}")
+        except (PyMongoError, InvalidId) as e:
+            logger.error("Failed to update status: %s", e)
             return False
 
-    def save_corrections(self, invoice_id: str, corrections: Dict[str, Any]) -> bool:
+    async def save_corrections(self, invoice_id: str, corrections: Dict[str, Any]) -> bool:
         """Save manual corrections to invoice"""
         try:
-            result = self.db.invoices.update_one(
+            now = datetime.utcnow()
+            result = await self.db.invoices.update_one(
                 {"_id": ObjectId(invoice_id)},
                 {
                     "$set": {
                         "corrections": corrections,
                         "status": "approved",
-                        "updated_at": datetime.utcnow(),
+                        "updated_at": now,
                         "notes": "Manually corrected"
                     }
                 }
             )
 
             # Log corrections to audit trail
-            self.db.audit_log.insert_one({
+            await self.db.audit_log.insert_one({
                 "invoice_id": ObjectId(invoice_id),
                 "action": "corrected",
-                "timestamp": datetime.utcnow(),
+                "timestamp": now,
                 "changes": corrections
             })
 
             return result.modified_count > 0
 
-        except Exception as e:
-            logger.error(f"Failed to save corrections: {str(e)}")
+        except (PyMongoError, InvalidId) as e:
+            logger.error("Failed to save corrections: %s", e)
             return False
 
-    def get_analytics(self) -> Dict[str, Any]:
+    async def get_analytics(self) -> Dict[str, Any]:
         """Get dashboard analytics"""
         try:
-            total = self.db.invoices.count_documents({})
-            auto_approved = self.db.invoices.count_documents({"status": "auto_approved"})
-            needs_review = self.db.invoices.count_documents({"status": "needs_review"})
-            approved = self.db.invoices.count_documents({"status": "approved"})
-            rejected = self.db.invoices.count_documents({"status": "rejected"})
+            total = await self.db.invoices.count_documents({})
+            auto_approved = await self.db.invoices.count_documents({"status": "auto_approved"})
+            needs_review = await self.db.invoices.count_documents({"status": "needs_review"})
+            approved = await self.db.invoices.count_documents({"status": "approved"})
+            rejected = await self.db.invoices.count_documents({"status": "rejected"})
 
             # Calculate average confidence
             pipeline = [
@@ -206,7 +241,7 @@ class InvoiceModel:
                     }
                 }
             ]
-            avg_conf_result = list(self.db.invoices.aggregate(pipeline))
+            avg_conf_result = await self.db.invoices.aggregate(pipeline).to_list(length=1)
             avg_confidence = avg_conf_result[0]["avg_confidence"] if avg_conf_result else 0
 
             return {
@@ -219,13 +254,13 @@ class InvoiceModel:
                 "average_confidence": round(avg_confidence, 2)
             }
 
-        except Exception as e:
-            logger.error(f"Failed to get analytics: {str(e)}")
+        except PyMongoError as e:
+            logger.error("Failed to get analytics: %s", e)
             return {}
 
-    def export_to_csv_format(self, status: Optional[str] = None, limit: int = 1000) -> List[Dict]:
+    async def export_to_csv_format(self, status: Optional[str] = None, limit: int = 1000) -> List[Dict]:
         """Export invoices in CSV-compatible format"""
-        invoices = self.get_all_invoices(status=status, limit=limit)
+        invoices = await self.get_all_invoices(status=status, limit=limit)
 
         csv_data = []
         for inv in invoices:
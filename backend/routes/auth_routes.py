@@ -1,9 +1,9 @@
-from flask import Blueprint, request, jsonify
+from quart import Blueprint, request, jsonify
 
 auth_bp = Blueprint("auth", __name__, url_prefix="/api/auth")
 
 @auth_bp.route("/verify", methods=["POST", "OPTIONS"])
-def verify_user():
+async def verify_user():
     if request.method == "OPTIONS":
         return "", 200  # 👈 allow preflight
 
@@ -1,36 +1,175 @@
+import asyncio
+import hashlib
 import logging
-import json
+import orjson
 import os
 from datetime import datetime
+from functools import cache, lru_cache
+from typing import NamedTuple, Optional
 from uuid import uuid4
-from flask import Blueprint, request, jsonify
+from quart import Blueprint, request, jsonify, websocket
 from bson import ObjectId
+from bson.errors import InvalidId
+from cachetools import TTLCache
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
 from config import Config
 from services.groq_extractor import GroqExtractor
 from services.canonicalizer import DataCanonicalizer
 from services.confidence_scorer import ConfidenceScorer
+from services.change_feed import ChangeFeed
 from utils.validators import InvoiceValidator
 from models.invoices import InvoiceModel
 from utils.image_quality import check_image_quality
+from utils.query_cache import QueryCache
 
 logger = logging.getLogger(__name__)
 
 # This prefix means all routes here start with /api
 extract_bp = Blueprint('extract', __name__, url_prefix='/api')
 
-# Initialize services
-groq_extractor = GroqExtractor()
-canonicalizer = DataCanonicalizer()
-confidence_scorer = ConfidenceScorer()
 invoice_model = None  # Initialized in app.py
+query_cache = QueryCache(maxsize=Config.QUERY_CACHE_MAXSIZE, ttl=Config.QUERY_CACHE_TTL)
+# Serialized Groq extractions keyed by upload content hash (bytes, so hits can't be mutated)
+extraction_cache = TTLCache(maxsize=Config.EXTRACTION_CACHE_MAXSIZE, ttl=Config.EXTRACTION_CACHE_TTL)
+# Pushes invoice changes to websocket subscribers; also invalidates this worker's query cache
+change_feed = ChangeFeed(on_change=query_cache.invalidate)
+
+# Bounds in-flight extractions (upload buffers, OpenCV decodes, Groq calls) per worker
+_extract_slots = asyncio.Semaphore(Config.EXTRACT_CONCURRENCY)
+
+# Strong references to in-flight background saves (asyncio only keeps weak ones)
+_pending_saves = set()
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Headroom for multipart boundaries/part headers in the early Content-Length check
+MULTIPART_OVERHEAD = 64 * 1024
+
+# Services are built on first use, inside the worker that serves the request,
+# so importing this module (e.g. in a preloading master) opens no clients
+@cache
+def get_groq_extractor() -> GroqExtractor:
+    return GroqExtractor()
+
+@cache
+def get_canonicalizer() -> DataCanonicalizer:
+    return DataCanonicalizer()
+
+@cache
+def get_confidence_scorer() -> ConfidenceScorer:
+    return ConfidenceScorer()
 
 def set_invoice_model(model: InvoiceModel):
     """Set the invoice model instance"""
     global invoice_model
     invoice_model = model
 
+async def close_services():
+    """Close pooled clients of services that were actually created (called on app shutdown)"""
+    if get_groq_extractor.cache_info().currsize:
+        await get_groq_extractor().aclose()
+
+def _on_save_done(task: asyncio.Task, user_id: str):
+    """Release the background save and surface failures"""
+    _pending_saves.discard(task)
+    if task.cancelled():
+        return
+    if task.exception() is not None:
+        logger.error("Background save failed for user %s", user_id, exc_info=task.exception())
+        return
+    query_cache.invalidate(user_id)
+
+async def drain_pending_saves():
+    """Wait for in-flight background saves (called on app shutdown)"""
+    if _pending_saves:
+        await asyncio.gather(*_pending_saves, return_exceptions=True)
+
+async def _find_cached_extraction(file_hash: str) -> Optional[dict]:
+    """Look up a previous extraction of identical bytes: in-process cache first, then MongoDB"""
+    cached = extraction_cache.get(file_hash)
+    if cached is not None:
+        return orjson.loads(cached)
+    if invoice_model:
+        try:
+            extracted_data = await invoice_model.find_extraction_by_hash(file_hash)
+        except PyMongoError as e:
+            # Best effort: a failed lookup is a miss, the upload still goes to Groq
+            logger.warning("Duplicate-upload lookup failed: %s", e)
+            return None
+        if extracted_data:
+            extraction_cache[file_hash] = orjson.dumps(extracted_data)
+            return extracted_data
+    return None
+
+@lru_cache(maxsize=4096)
+def _extract_user_id(raw_token: str) -> Optional[str]:
+    """
+    Parse the JSON bearer token once per distinct token and return its email.
+    Raises ValueError (or orjson.JSONDecodeError) for malformed tokens; those are not cached.
+    """
+    data = orjson.loads(raw_token)
+    # Handle cases where the token might be double-encoded as a string
+    if isinstance(data, str): data = orjson.loads(data)
+    if not isinstance(data, dict):
+        raise ValueError("Token payload must be an object")
+    # We prioritize 'email' to match the retrieval query in get_invoices
+    email = data.get("email")
+    # The result is shared through lru_cache and used in query-cache keys: strings only
+    if email is not None and not isinstance(email, str):
+        raise ValueError("Token email must be a string")
+    return email
+
+def _read_upload(file, max_size: int, size_hint: Optional[int] = None) -> Optional[bytearray]:
+    """Read the upload stream once, in chunks. Returns None if it exceeds max_size."""
+    if size_hint and size_hint <= max_size:
+        # Content-Length bounds the file size, so one preallocated buffer suffices
+        buf = bytearray(size_hint)
+        read_total = 0
+        with memoryview(buf) as view:
+            while read_total < size_hint:
+                read = file.stream.readinto(view[read_total:])
+                if not read:
+                    break
+                read_total += read
+        del buf[read_total:]
+        return buf
+
+    buf = bytearray()
+    chunk = file.stream.read(UPLOAD_CHUNK_SIZE)
+    while chunk:
+        buf.extend(chunk)
+        if len(buf) > max_size:
+            return None
+        chunk = file.stream.read(UPLOAD_CHUNK_SIZE)
+    return buf
+
+class UploadScan(NamedTuple):
+    """Result of the single read/hash/quality pass over an upload"""
+    data: Optional[bytearray]  # None when the upload exceeds the size limit
+    file_hash: Optional[str]
+    is_bad: bool
+    reason: str
+    score: float
+
+def _read_and_check(file, max_size: int, size_hint: Optional[int], check_quality: bool) -> UploadScan:
+    """
+    Read the upload once, release the form parser's copy, then hash and
+    quality-check that same buffer. Runs in a worker thread (all CPU-bound).
+    """
+    data = _read_upload(file, max_size, size_hint=size_hint)
+    file.close()
+    if data is None:
+        return UploadScan(None, None, False, "File too large", 0.0)
+
+    file_hash = hashlib.blake2b(data, digest_size=32).hexdigest()
+    if check_quality:
+        is_bad, reason, score = check_image_quality(data, blur_threshold=450.0, contrast_threshold=35.0)
+    else:
+        is_bad, reason, score = False, "Quality OK", 0.0
+    return UploadScan(data, file_hash, is_bad, reason, score)
+
 @extract_bp.route('/health', methods=['GET'])
-def health():
+async def health():
     return jsonify({
         "status": "healthy",
         "service": "invoice-extractor",
@@ -39,7 +178,7 @@ def health():
     }), 200
 
 @extract_bp.route('/extract', methods=['POST'])
-def extract_invoice():
+async def extract_invoice():
     """
     Extract invoice data and store it in MongoDB under the specific user's identifier.
     """
@@ -47,77 +186,105 @@ def extract_invoice():
     auth_header = request.headers.get("Authorization", "")
     raw_token = auth_header.replace("Bearer ", "").strip()
     try:
-        data = json.loads(raw_token)
-        # Handle cases where the token might be double-encoded as a string
-        if isinstance(data, str): data = json.loads(data)
-        
-        # We prioritize 'email' to match the retrieval query in get_invoices
-        user_id = data.get("email")
-        
-        if not user_id: 
-            return jsonify({"error": "Token missing identifier"}), 401
-    except Exception:
+        user_id = _extract_user_id(raw_token)
+    except ValueError:
         return jsonify({"error": "Invalid token format"}), 401
+    if not user_id: 
+        return jsonify({"error": "Token missing identifier"}), 401
 
-    # 2. File Check
-    if 'file' not in request.files: 
+    # 2. Size Check: coarse request-size guard before the multipart body is parsed;
+    # the exact file cap is enforced while reading the upload
+    max_request_size = Config.MAX_FILE_SIZE + MULTIPART_OVERHEAD
+    if request.content_length and request.content_length > max_request_size:
+        return jsonify({
+            "error": f"Request too large ({request.content_length} bytes, limit {max_request_size} bytes)"
+        }), 413
+
+    # 3. Admission Control: shed load with a fast 503 instead of queueing without bound
+    try:
+        await asyncio.wait_for(_extract_slots.acquire(), timeout=Config.EXTRACT_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        return jsonify({"error": "Server busy, please retry"}), 503, {"Retry-After": "1"}
+    try:
+        return await _process_upload(user_id)
+    finally:
+        _extract_slots.release()
+
+
+async def _process_upload(user_id: str):
+    """Body of /extract once the request holds an extraction slot"""
+    # 4. File Check
+    files = await request.files
+    if 'file' not in files: 
         return jsonify({"error": "No file provided"}), 400
-    file = request.files['file']
+    file = files['file']
     if file.filename == '': 
         return jsonify({"error": "No file selected"}), 400
 
-    # 3. Size Check
-    file.seek(0, os.SEEK_END)
-    file_length = file.tell()
-    file.seek(0)
-    if file_length > Config.MAX_FILE_SIZE:
-        return jsonify({"error": f"File too large ({file_length} bytes)"}), 413
-
-    # 4. Quality Check (Non-PDFs)
-    file_ext = os.path.splitext(file.filename)[1].lower()
-    file_bytes = file.read()
-    file.seek(0)
-    if file_ext != '.pdf':
-        is_bad, reason, score = check_image_quality(file_bytes, blur_threshold=450.0, contrast_threshold=35.0)
-        if is_bad:
-            return jsonify({
-                "success": False,
-                "error": f"Quality Check Failed: {reason}",
-                "quality_score": round(score, 2)
-            }), 400
-
-    # 5. Extraction Logic
+    # 5. Read + Hash + Quality Check (Non-PDFs) in one pass over one buffer, off the event loop
+    filename = file.filename
+    file_ext = os.path.splitext(filename)[1].lower()
+    scan = await asyncio.to_thread(
+        _read_and_check, file, Config.MAX_FILE_SIZE, request.content_length, file_ext != '.pdf'
+    )
+    if scan.data is None:
+        return jsonify({"error": f"File too large (limit {Config.MAX_FILE_SIZE} bytes)"}), 413
+    if scan.is_bad:
+        return jsonify({
+            "success": False,
+            "error": f"Quality Check Failed: {scan.reason}",
+            "quality_score": round(scan.score, 2)
+        }), 400
+    file_bytes, file_hash = scan.data, scan.file_hash
+    del scan
+
+    # 6. Extraction Logic
     try:
-        image_base64 = groq_extractor.encode_image(file)
-        raw_response = groq_extractor.extract(image_base64)
+        # Duplicate uploads (retries, forwarded emails) reuse the earlier extraction
+        extracted_data = await _find_cached_extraction(file_hash)
+
+        if extracted_data is not None:
+            usage_stats = {"cache_hit": True}
+        else:
+            raw_response = await get_groq_extractor().extract(file_bytes)
 
-        if "error" in raw_response:
-            return jsonify({"success": False, "error": raw_response['error']}), 500
+            if "error" in raw_response:
+                return jsonify({"success": False, "error": raw_response['error']}), 500
 
-        usage_stats = raw_response.pop("_usage", {})
-        extracted_data = raw_response
+            usage_stats = raw_response.pop("_usage", {})
+            extracted_data = raw_response
+            extraction_cache[file_hash] = orjson.dumps(extracted_data)
+
+        # The raw upload is no longer needed; free it before the response is built
+        del file_bytes
 
         # Canonicalize & Validate content
-        canonical_data = canonicalizer.canonicalize_invoice(extracted_data)
+        canonical_data = get_canonicalizer().canonicalize_invoice(extracted_data)
         is_valid_content, val_error = InvoiceValidator.validate_invoice(canonical_data)
-        confidence_scores = confidence_scorer.calculate_confidence(canonical_data)
+        confidence_scores = get_confidence_scorer().calculate_confidence(canonical_data)
         
         # Get status (approved, rejected, or needs_review)
         status = confidence_scores.get('status', 'needs_review')
 
-        # 6. Save to DB
+        # 7. Save to DB in the background; the response already carries everything
         invoice_id = str(uuid4())
         if invoice_model:
+            object_id = ObjectId()
+            invoice_id = str(object_id)
             # We save the 'user_id' into the 'userId' field in MongoDB
-            invoice_id = invoice_model.save_extraction(
+            task = asyncio.create_task(invoice_model.save_extraction(
                 extracted_data=extracted_data,
                 canonical_data=canonical_data,
                 confidence_scores=confidence_scores,
                 status=status,
-                original_filename=file.filename,
+                original_filename=filename,
                 metadata={"usage": usage_stats},
-                user_id=user_id 
-            )
+                user_id=user_id,
+                invoice_id=object_id,
+                file_hash=file_hash
+            ))
+            _pending_saves.add(task)
+            task.add_done_callback(lambda t: _on_save_done(t, user_id))
 
         return jsonify({
             "success": True,
@@ -133,13 +300,13 @@ def extract_invoice():
             "timestamp": datetime.utcnow().isoformat()
         }), 200
 
-    except Exception as e:
-        logger.error(f"Extraction failed: {str(e)}")
+    except PyMongoError as e:
+        logger.exception("Extraction failed", extra={"user_id": user_id})
         return jsonify({"success": False, "error": str(e)}), 500
 
 
 @extract_bp.route('/invoices/<invoice_id>/status', methods=['PUT', 'OPTIONS'])
-def update_invoice_status(invoice_id):
+async def update_invoice_status(invoice_id):
     """Updates the status (approved/rejected) and logs the approver."""
     if request.method == 'OPTIONS':
         return '', 200
@@ -148,56 +315,73 @@ def update_invoice_status(invoice_id):
         return jsonify({"error": "Database not initialized"}), 500
 
     try:
-        data = request.json
+        object_id = ObjectId(invoice_id)
+    except (InvalidId, TypeError):
+        return jsonify({"error": "Invalid invoice id"}), 400
+
+    try:
+        data = await request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return jsonify({"error": "Invalid request body"}), 400
         new_status = data.get('status')
         approver = data.get('approved_by')
 
         if new_status not in ['approved', 'rejected']:
             return jsonify({"error": "Invalid status value"}), 400
 
+        # Store native BSON datetimes (sortable, range-queryable) rather than ISO strings
+        now = datetime.utcnow()
         update_fields = {
             "confidence_scores.status": new_status, 
             "status": new_status,
             "approved_by": approver,
-            "approved_at": datetime.utcnow().isoformat(),
-            "updated_at": datetime.utcnow().isoformat()
+            "approved_at": now,
+            "updated_at": now
         }
 
-        result = invoice_model.db.invoices.update_one(
-            {"_id": ObjectId(invoice_id)},
-            {"$set": update_fields}
+        # Single round-trip: update and read back the owner + new status atomically
+        updated = await invoice_model.db.invoices.find_one_and_update(
+            {"_id": object_id},
+            {"$set": update_fields},
+            projection={"status": 1, "userId": 1},
+            return_document=ReturnDocument.AFTER
         )
 
-        if result.matched_count == 0:
+        if updated is None:
             return jsonify({"error": "Invoice not found"}), 404
+        query_cache.invalidate(updated.get("userId"))
 
         return jsonify({
             "success": True, 
-            "message": f"Invoice marked as {new_status}",
-            "id": invoice_id
+            "message": f"Invoice marked as {updated['status']}",
+            "id": invoice_id,
+            "status": updated["status"]
         }), 200
 
-    except Exception as e:
-        logger.error(f"Status update failed: {str(e)}")
+    except PyMongoError as e:
+        logger.exception("Status update failed", extra={"invoice_id": invoice_id})
         return jsonify({"error": str(e)}), 500
 
 
 @extract_bp.route('/review-queue', methods=['GET'])
-def get_review_queue():
+async def get_review_queue():
     if not invoice_model: return jsonify({"error": "Database error"}), 500
-    invoices = invoice_model.get_review_queue(limit=20)
+    invoices = await query_cache.get_or_load(
+        ("review_queue", None, 20),
+        lambda: invoice_model.get_review_queue(limit=20)
+    )
     return jsonify({"invoices": invoices, "count": len(invoices)}), 200
 
 
 @extract_bp.route('/analytics', methods=['GET'])
-def get_analytics():
+async def get_analytics():
     if not invoice_model: return jsonify({"error": "Database error"}), 500
-    analytics = invoice_model.get_analytics()
+    analytics = await query_cache.get_or_load(("analytics", None), invoice_model.get_analytics)
     return jsonify(analytics), 200
 
 
 @extract_bp.route('/invoices', methods=['GET'])
-def get_invoices():
+async def get_invoices():
     """Fetch all invoices for the specific user's Activity Feed."""
     if not invoice_model: return jsonify({"error": "Database error"}), 500
 
@@ -205,23 +389,20 @@ def get_invoices():
     raw_token = auth_header.replace("Bearer ", "").strip()
 
     try:
-        data = json.loads(raw_token)
-        if isinstance(data, str): data = json.loads(data)
         # Search by email (this matches the saved userId from the extract route)
-        user_id = data.get("email")
-    except Exception:
+        user_id = _extract_user_id(raw_token)
+    except ValueError:
         return jsonify({"error": "Invalid token"}), 401
 
-    limit = int(request.args.get('limit', 50))
+    limit = request.args.get('limit', 50, type=int)
+    # Negative limits make Motor's to_list raise; also bound the page size
+    limit = max(1, min(limit, 1000))
     
     try:
-        # Search MongoDB using 'userId' field exactly
-        query = {"userId": user_id}
-        cursor = invoice_model.db.invoices.find(query).sort("created_at", -1).limit(limit)
-        invoices = list(cursor)
-
-        for inv in invoices:
-            inv["_id"] = str(inv["_id"])
+        invoices = await query_cache.get_or_load(
+            ("invoices", user_id, limit),
+            lambda: invoice_model.get_user_invoices(user_id, limit=limit)
+        )
 
         return jsonify({
             "success": True,
@@ -229,6 +410,35 @@ def get_invoices():
             "invoices": invoices 
         }), 200
 
-    except Exception as e:
-        logger.error(f"Error fetching invoices: {str(e)}")
-        return jsonify({"success": False, "error": str(e)}), 500
\ No newline at end of file
+    except PyMongoError as e:
+        logger.exception("Error fetching invoices", extra={"user_id": user_id})
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@extract_bp.websocket('/ws/review-queue')
+async def review_queue_updates():
+    """
+    Push the user's invoice inserts/updates as they happen.
+    Clients load the initial state from GET /invoices or /review-queue, then listen here
+    instead of polling. Browsers can't set headers on websockets, so the token is a query arg.
+    """
+    try:
+        user_id = _extract_user_id(websocket.args.get("token", ""))
+    except ValueError:
+        user_id = None
+    if not user_id:
+        await websocket.close(1008, "Invalid token")
+        return
+
+    await websocket.accept()
+    queue = change_feed.subscribe(user_id)
+    try:
+        while True:
+            event = await queue.get()
+            if event is None:
+                # Change feed stopped for good: the client falls back to polling
+                await websocket.close(1011, "Change feed unavailable")
+                return
+            await websocket.send_json(event)
+    finally:
+        change_feed.unsubscribe(user_id, queue)
@@ -40,8 +40,8 @@ class DataCanonicalizer:
             # Use dateparser for robust multi-format parsing
             parsed_date = date_parser.parse(date_str)
             return parsed_date.strftime("%Y-%m-%d")
-        except:
-            logger.warning(f"Could not parse date: {date_str}")
+        except (ValueError, OverflowError):
+            logger.warning("Could not parse date: %s", date_str)
             return None
 
     @staticmethod
@@ -64,12 +64,12 @@ class DataCanonicalizer:
         try:
             parsed_time = datetime.strptime(time_str, "%H:%M:%S")
             return parsed_time.strftime("%H:%M:%S")
-        except:
+        except ValueError:
             try:
                 parsed_time = datetime.strptime(time_str, "%H:%M")
                 return parsed_time.strftime("%H:%M:00")
-            except:
-                logger.warning(f"Could not parse time: {time_str}")
+            except ValueError:
+                logger.warning("Could not parse time: %s", time_str)
                 return None
 
     @staticmethod
@@ -141,7 +141,7 @@ class DataCanonicalizer:
             return round(float(cleaned), 2), detected_currency
 
         except Exception as e:
-            logger.warning(f"Could not normalize currency: {amount} - {str(e)}")
+            logger.warning("Could not normalize currency: %s - %s", amount, e)
             return None, None
 
     @staticmethod
@@ -296,5 +296,5 @@ class DataCanonicalizer:
             return invoice_data
 
         except Exception as e:
-            logger.error(f"Canonicalization failed: {str(e)}")
+            logger.exception("Canonicalization failed: %s", e)
             return invoice_data
\ No newline at end of file
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Optional, Set
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeFeed:
+    """
+    Fans out MongoDB change-stream events on the invoices collection to
+    per-user subscriber queues (used by the dashboard websocket).
+    One change stream per worker replaces every client polling the database.
+    """
+
+    # Insert/update events only; heavy fields are dropped server-side
+    PIPELINE = [
+        {"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}},
+        {"$project": {
+            "fullDocument.canonical_data": 0,
+            "fullDocument.api_metadata": 0,
+            "fullDocument.corrections": 0,
+            "fullDocument.file_hash": 0
+        }}
+    ]
+    QUEUE_SIZE = 100
+    # $changeStream is only supported on replica sets / Atlas. Election errors such as
+    # NotPrimaryOrSecondary (13436) are resumable and go through the reopen path instead
+    UNSUPPORTED_ERROR_CODE = 40573
+    # The resume token fell off the oplog; only a fresh stream can recover
+    HISTORY_LOST_ERROR_CODE = 286
+    RETRY_DELAY = 1.0
+    MAX_RETRY_DELAY = 30.0
+
+    def __init__(self, on_change: Optional[Callable[[Optional[str]], Any]] = None):
+        """on_change(user_id) is called for every event, e.g. to invalidate caches"""
+        self.on_change = on_change
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        """
+        Register a queue that receives this user's invoice events.
+        A None event means the feed has stopped for good and the subscriber should disconnect.
+        """
+        queue = asyncio.Queue(maxsize=self.QUEUE_SIZE)
+        if self._closed:
+            queue.put_nowait(None)
+            return queue
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(user_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[user_id]
+
+    def dispatch(self, change: Dict[str, Any]):
+        """Route one change event to the owning user's subscribers"""
+        invoice = change.get("fullDocument") or {}
+        user_id = invoice.get("userId")
+        if self.on_change:
+            self.on_change(user_id)
+
+        event = {"type": change.get("operationType"), "invoice": invoice}
+        for queue in self._subscribers.get(user_id, ()):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Slow client: drop the event, it can re-fetch the HTTP snapshot
+                logger.warning("Change feed queue full for user %s, dropping event", user_id)
+
+    def close_subscribers(self):
+        """Tell every subscriber the feed is gone so clients fall back to polling"""
+        self._closed = True
+        for queues in self._subscribers.values():
+            for queue in queues:
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    async def run(self, collection):
+        """Consume the change stream until cancelled, reopening it after transient errors"""
+        resume_token = None
+        delay = self.RETRY_DELAY
+        while True:
+            try:
+                async with collection.watch(self.PIPELINE, full_document="updateLookup",
+                                            resume_after=resume_token) as stream:
+                    logger.info("Change feed started")
+                    async for change in stream:
+                        resume_token = change["_id"]
+                        delay = self.RETRY_DELAY
+                        self.dispatch(change)
+            except OperationFailure as e:
+                if e.code == self.UNSUPPORTED_ERROR_CODE:
+                    # Standalone server: no change streams, clients keep polling
+                    logger.warning("Change feed unavailable: %s", e)
+                    self.close_subscribers()
+                    return
+                if e.code == self.HISTORY_LOST_ERROR_CODE:
+                    resume_token = None
+                logger.warning("Change feed interrupted, reopening in %.0fs: %s", delay, e)
+            except PyMongoError as e:
+                logger.warning("Change feed interrupted, reopening in %.0fs: %s", delay, e)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.MAX_RETRY_DELAY)
+
+    def start(self, collection):
+        """Start consuming in the background (called once the database is ready)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run(collection))
+
+    async def stop(self):
+        """Cancel the background consumer (called on app shutdown)"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
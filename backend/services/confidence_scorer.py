@@ -241,7 +241,7 @@ class ConfidenceScorer:
             }
 
         except Exception as e:
-            logger.error(f"Confidence scoring failed: {str(e)}")
+            logger.exception("Confidence scoring failed: %s", e)
             return {
                 'overall_confidence': 0.0,
                 'field_confidence': {},
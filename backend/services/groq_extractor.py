@@ -1,8 +1,9 @@
-import base64
-import json
+import asyncio
+import pybase64
+import orjson
 import logging
-from groq import Groq
-from typing import Dict, Any, Optional
+import httpx
+from typing import Dict, Any, AsyncIterator, Iterator, Optional, Tuple
 from config import Config
 
 logger = logging.getLogger(__name__)
@@ -10,20 +11,45 @@ logger = logging.getLogger(__name__)
 class GroqExtractor:
     """Handles Groq API calls for invoice extraction"""
 
+    # Multiple of 3 so every chunk but the last encodes without base64 padding
+    BASE64_CHUNK_SIZE = 3 * 64 * 1024
+    IMAGE_PLACEHOLDER = "__IMAGE_BASE64__"
+    # Same retry policy as the groq SDK: connection errors/timeouts, 408/409/429 and 5xx, honouring retry-after
+    RETRY_STATUS_CODES = {408, 409, 429}
+    MAX_RETRY_DELAY = 60.0
+
     def __init__(self):
-        self.client = Groq(api_key=Config.GROQ_API_KEY)
+        # One shared client per process: HTTP/2 + keep-alive lets concurrent
+        # extractions reuse a single TLS connection to Groq
+        self.client = httpx.AsyncClient(
+            http2=True,
+            base_url=Config.GROQ_BASE_URL,
+            headers={"Authorization": f"Bearer {Config.GROQ_API_KEY}"},
+            timeout=Config.GROQ_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=Config.GROQ_MAX_CONNECTIONS,
+                max_keepalive_connections=Config.GROQ_MAX_KEEPALIVE_CONNECTIONS
+            )
+        )
         self.model = Config.GROQ_MODEL
+        # The request body is constant except for the image: serialize it once
+        self._request_prefix, self._request_suffix = self.build_request_parts()
+
+    async def aclose(self):
+        """Close the pooled HTTP client (called on app shutdown)"""
+        await self.client.aclose()
+
+    @classmethod
+    def iter_base64(cls, file_bytes) -> Iterator[bytes]:
+        """Encode raw upload bytes to base64 chunk by chunk (joined, equals b64encode(file_bytes))"""
+        view = memoryview(file_bytes)
+        for start in range(0, len(view), cls.BASE64_CHUNK_SIZE):
+            yield pybase64.b64encode(view[start:start + cls.BASE64_CHUNK_SIZE])
 
     @staticmethod
-    def encode_image(file_obj) -> str:
-        """Convert uploaded file to base64 string"""
-        try:
-            # Ensure we are at the start of the file
-            file_obj.seek(0)
-            return base64.b64encode(file_obj.read()).decode('utf-8')
-        except Exception as e:
-            logger.error(f"Image encoding failed: {str(e)}")
-            raise ValueError(f"Failed to encode image: {str(e)}")
+    def base64_length(size: int) -> int:
+        """Length of the padded base64 encoding of size bytes"""
+        return 4 * ((size + 2) // 3)
 
     def get_extraction_prompt(self) -> str:
         """Generate detailed extraction prompt with ALL required fields"""
@@ -43,52 +69,126 @@ RULES:
 """
 
 
-    def extract(self, image_base64: str) -> Dict[str, Any]:
-        """Call Groq API to extract invoice data with usage tracking"""
-        try:
-            prompt = self.get_extraction_prompt()
-
-            chat_completion = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{image_base64}",
-                                },
+    def build_request_parts(self) -> Tuple[bytes, bytes]:
+        """Serialize the chat request around the image, returning (prefix, suffix) bytes"""
+        payload = {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": self.get_extraction_prompt()},
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:image/jpeg;base64,{self.IMAGE_PLACEHOLDER}",
                             },
-                        ],
-                    }
-                ],
-                response_format={"type": "json_object"},
-                temperature=0.1,
-                # Reverted back to max_tokens for SDK compatibility
-                max_tokens=4096, 
-            )
+                        },
+                    ],
+                }
+            ],
+            "response_format": {"type": "json_object"},
+            "temperature": 0.1,
+            "max_tokens": 4096,
+        }
+        prefix, suffix = orjson.dumps(payload).split(self.IMAGE_PLACEHOLDER.encode(), 1)
+        return prefix, suffix
+
+    async def _request_body(self, file_bytes) -> AsyncIterator[bytes]:
+        """
+        Stream the JSON body: the base64 image is encoded chunk by chunk as it is
+        sent, so the full base64 string and JSON document are never materialized
+        """
+        yield self._request_prefix
+        for chunk in self.iter_base64(file_bytes):
+            yield chunk
+        yield self._request_suffix
+
+    @classmethod
+    def _should_retry(cls, response: httpx.Response) -> bool:
+        return response.status_code in cls.RETRY_STATUS_CODES or response.status_code >= 500
+
+    @classmethod
+    def _retry_delay(cls, response: Optional[httpx.Response], attempt: int) -> float:
+        """Wait as long as retry-after-ms / retry-after asks, else back off exponentially"""
+        if response is not None:
+            for header, scale in (("retry-after-ms", 1000.0), ("retry-after", 1.0)):
+                value = response.headers.get(header)
+                if value:
+                    try:
+                        return min(max(float(value) / scale, 0.0), cls.MAX_RETRY_DELAY)
+                    except ValueError:
+                        pass  # HTTP-date form; fall back to backoff
+        return min(0.5 * 2 ** attempt, 8.0)
 
-            response_text = chat_completion.choices[0].message.content
-            extracted_data = json.loads(response_text)
+    @staticmethod
+    def _error_message(response: httpx.Response) -> str:
+        """Groq's own error.message from an error response, falling back to the status code"""
+        try:
+            message = orjson.loads(response.content)["error"]["message"]
+        except (orjson.JSONDecodeError, KeyError, TypeError):
+            message = response.reason_phrase
+        return f"Error code: {response.status_code} - {message}"
+
+    async def _post_chat_completion(self, file_bytes) -> httpx.Response:
+        """POST the extraction request, retrying transient failures up to GROQ_MAX_RETRIES times"""
+        content_length = len(self._request_prefix) + self.base64_length(len(file_bytes)) + len(self._request_suffix)
+        headers = {"Content-Type": "application/json", "Content-Length": str(content_length)}
+
+        for attempt in range(Config.GROQ_MAX_RETRIES + 1):
+            is_last = attempt == Config.GROQ_MAX_RETRIES
+            try:
+                # A streamed body can only be sent once: build a fresh generator per attempt
+                response = await self.client.post(
+                    "/openai/v1/chat/completions",
+                    content=self._request_body(file_bytes),
+                    headers=headers
+                )
+            except httpx.TransportError as e:
+                # Timeouts, connect errors and resets/GOAWAY on idle pooled HTTP/2 connections
+                if is_last:
+                    raise
+                delay = self._retry_delay(None, attempt)
+                logger.warning("Groq request failed (%r), retrying in %.2fs", e, delay)
+            else:
+                if is_last or not self._should_retry(response):
+                    return response
+                delay = self._retry_delay(response, attempt)
+                logger.warning("Groq returned %s, retrying in %.2fs", response.status_code, delay)
+            await asyncio.sleep(delay)
+
+    async def extract(self, file_bytes) -> Dict[str, Any]:
+        """Call Groq API to extract invoice data with usage tracking"""
+        try:
+            response = await self._post_chat_completion(file_bytes)
+            if response.is_error:
+                message = self._error_message(response)
+                logger.error("Groq request failed: %s", message)
+                return {"error": f"Extraction service error: {message}"}
+            chat_completion = orjson.loads(response.content)
+
+            response_text = chat_completion["choices"][0]["message"]["content"]
+            extracted_data = orjson.loads(response_text)
             
             # Capture usage stats for rate-limit management
-            usage = chat_completion.usage
+            usage = chat_completion.get("usage", {})
             extracted_data["_usage"] = {
-                "prompt_tokens": usage.prompt_tokens,
-                "completion_tokens": usage.completion_tokens,
-                "total_tokens": usage.total_tokens
+                "prompt_tokens": usage.get("prompt_tokens"),
+                "completion_tokens": usage.get("completion_tokens"),
+                "total_tokens": usage.get("total_tokens")
             }
 
-            logger.info(f"Extraction successful. Tokens used: {usage.total_tokens}")
+            logger.info("Extraction successful. Tokens used: %s", usage.get("total_tokens"))
             return extracted_data
 
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse Groq response: {str(e)}")
+        except orjson.JSONDecodeError as e:
+            logger.error("Failed to parse Groq response: %s", e)
             return {"error": "Invalid JSON response from model"}
-        except Exception as e:
-            logger.error(f"Groq extraction failed: {str(e)}")
+        except httpx.HTTPError as e:
+            logger.error("Groq request failed: %s", e)
+            return {"error": f"Extraction service error: {str(e)}"}
+        except (KeyError, IndexError, TypeError) as e:
+            logger.error("Unexpected Groq response shape: %s", e)
             return {"error": f"Extraction service error: {str(e)}"}
 
     def validate_response_structure(self, data: Dict) -> tuple[bool, Optional[str]]:
@@ -37,13 +37,13 @@ def check_image_quality(file_bytes, blur_threshold=160.0, contrast_threshold=40.
 
         # 4. Contrast Check (New Extremity: Faint text)
         contrast = gray.std() # Standard deviation of pixel intensities
-        logger.info(f"Quality Scores -> Blur: {variance:.2f}, Contrast: {contrast:.2f}, Brightness: {avg_brightness:.2f}")
+        logger.info("Quality Scores -> Blur: %.2f, Contrast: %.2f, Brightness: %.2f", variance, contrast, avg_brightness)
         
         if contrast < contrast_threshold:
             return True, "Contrast too low (Text is too faint)", contrast
 
         return False, "Quality OK", variance
 
-    except Exception as e:
-        logger.error(f"Quality check failed: {str(e)}")
+    except cv2.error as e:
+        logger.error("Quality check failed: %s", e)
         return False, "Check failed", 0.0
\ No newline at end of file
@@ -0,0 +1,38 @@
+import logging
+from typing import Any, Awaitable, Callable, Hashable, Optional, Tuple
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCache:
+    """
+    Short-lived in-process cache for read-heavy dashboard queries.
+    Keys are (endpoint, user_id, *params); user_id is None for global queries.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 5.0):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get_or_load(self, key: Tuple[Hashable, ...], loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Return the cached value for key, awaiting loader() on a miss.
+        Empty results are not stored: the model methods return []/{} when MongoDB
+        errors, and caching that would blank every dashboard for the full TTL.
+        """
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        value = await loader()
+        if value:
+            self._cache[key] = value
+        return value
+
+    def invalidate(self, user_id: Optional[str] = None):
+        """Drop entries for user_id plus all global entries; no user_id clears everything"""
+        if user_id is None:
+            self._cache.clear()
+            return
+        for key in [k for k in list(self._cache.keys()) if k[1] in (user_id, None)]:
+            self._cache.pop(key, None)
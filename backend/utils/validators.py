@@ -7,6 +7,10 @@ logger = logging.getLogger(__name__)
 class InvoiceValidator:
     """Validates extracted and canonicalized invoice data"""
 
+    # Compiled once at import instead of per call
+    DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+    TIME_PATTERN = re.compile(r'^\d{2}:\d{2}:\d{2}$')
+
     @staticmethod
     def validate_company_name(name: Optional[str]) -> Tuple[bool, Optional[str]]:
         """Validate company name"""
@@ -23,8 +27,7 @@ class InvoiceValidator:
         """Validate date format YYYY-MM-DD"""
         if not date:
             return False, "Date is required"
-        pattern = r'^\d{4}-\d{2}-\d{2}$'
-        if not re.match(pattern, date):
+        if not InvoiceValidator.DATE_PATTERN.match(date):
             return False, "Date must be in YYYY-MM-DD format"
         return True, None
 
@@ -33,8 +36,7 @@ class InvoiceValidator:
         """Validate time format HH:MM:SS (optional)"""
         if not time:
             return True, None  # Time is optional
-        pattern = r'^\d{2}:\d{2}:\d{2}$'
-        if not re.match(pattern, time):
+        if not InvoiceValidator.TIME_PATTERN.match(time):
             return False, "Time must be in HH:MM:SS format"
         return True, None
 